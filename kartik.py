@@ -1,124 +1,478 @@
+import itertools
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
+from typing import Final
 import streamlit as st
-import requests
+import httpx
+import orjson
 import networkx as nx
+import numpy as np
 import plotly.graph_objects as go
-import io # Still potentially useful for other things, but not strictly for download anymore
+from scipy.optimize import minimize, minimize_scalar
 
 # -------------- Streamlit Page Configuration (MUST BE FIRST STREAMLIT COMMAND) --------------
 st.set_page_config(page_title="Prot'n'Hub", layout="wide")
 
-# -------------- Background Styling --------------
-def style_app_container():
-    css = f"""
-    <style>
-    .block-container {{
-        background-color: rgba(0, 0, 0, 0.6);
-        padding: 2rem 3rem;
-        border-radius: 1rem;
-        color: #333;
-        max-width: 1000px; 
-        margin: auto; 
-    }}
-    .stApp {{
-        /* background-color: #f0f2f6; */ 
-    }}
-    h1, h2, h3, h4, h5, h6 {{
-        color: #333; 
-    }}
-    </style>
-    """
-    st.markdown(css, unsafe_allow_html=True)
-
 # -------------- Constants --------------
-STRING_API_URL = "https://string-db.org/api"
-STRING_OUTPUT_FORMAT = "json"
-STRING_METHOD = "network"
+STRING_API_URL: Final = "https://string-db.org/api"
+STRING_OUTPUT_FORMAT: Final = "json"
+STRING_METHOD: Final = "network"
+MAX_IDS_PER_REQUEST: Final = 50  # longer identifier lists are fetched in parallel chunk-pair queries
+MAX_IDENTIFIERS: Final = 150  # chunk-pair queries grow quadratically; 150 IDs need 15 requests
+MAX_ADD_NODES: Final = 500  # STRING's add_nodes: partners beyond the query, so networks can outgrow MAX_IDENTIFIERS
+STRING_MAX_WORKERS: Final = 4
+STRING_MIN_INTERVAL: Final = 1.0  # seconds between request starts, as STRING asks of API clients
+STRING_RETRY_STATUSES: Final = frozenset({429, 500, 502, 503, 504})  # rate limiting and transient server errors
+STRING_MAX_RETRIES: Final = 2
+FETCH_MIN_SCORE: Final = 0.15  # realistic floor; higher thresholds are applied locally without refetching
+BARNES_HUT_MIN_NODES: Final = 500  # below this the dense all-pairs repulsion is faster than the grid
+LBFGS_MIN_NODES: Final = 200  # from here up to BARNES_HUT_MIN_NODES the layout minimizes the FR energy with L-BFGS
+SMALL_LAYOUT_NODES: Final = 20  # below this, layouts keep the original spring layout's wider spacing (k=0.5)
+WARM_START_ITERATIONS: Final = 15  # FR iterations when most nodes keep their position from the previous layout
+DEFAULT_MAX_NODES: Final = 150  # larger networks are trimmed to their best-connected proteins before layout
+NODE_COLORSCALE: Final = [[0, 'cornflowerblue'], [1, 'crimson']]
+ID_SEPARATORS: Final = re.compile(r'[,;\s]+')  # commas, semicolons, newlines and other whitespace
+CUSTOM_SPECIES: Final = "Custom (enter manually)"
+SPECIES_OPTIONS: Final = MappingProxyType({
+    "Human (Homo sapiens)": 9606,
+    "Mouse (Mus musculus)": 10090,
+    "Rat (Rattus norvegicus)": 10116,
+    "Zebrafish (Danio rerio)": 7955,
+    "Fruit fly (Drosophila melanogaster)": 7227,
+    "Yeast (Saccharomyces cerevisiae)": 4932,
+    "E. coli (Escherichia coli K12)": 83333,
+    CUSTOM_SPECIES: None,
+})
 
 # -------------- Functions --------------
-def get_string_interactions(uniprot_id, species=9606, min_score=0.4):
+@st.cache_resource
+def _http_client():
+    # One HTTP/2 connection pool shared by every session in the process (module globals are
+    # rebuilt on every Streamlit rerun); parallel chunk queries multiplex over one TLS connection
+    # Transport retries only cover failed connects; status retries happen in _post_string
+    transport = httpx.HTTPTransport(http2=True, retries=3,
+                                    limits=httpx.Limits(max_connections=STRING_MAX_WORKERS,
+                                                        max_keepalive_connections=STRING_MAX_WORKERS))
+    return httpx.Client(transport=transport, timeout=httpx.Timeout(30.0, connect=5.0))
+
+class _RequestPacer:
+    # Hands out request start times at least `interval` seconds apart, across threads
+    def __init__(self, interval):
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + self._interval
+        time.sleep(start - now)
+
+@st.cache_resource
+def _string_pacer():
+    # Shared like the HTTP client, so all sessions together stay within STRING's rate limit
+    return _RequestPacer(STRING_MIN_INTERVAL)
+
+def _post_string(method, params):
+    # One paced, retried STRING API call; raises on failure so callers can keep errors out of their caches
+    url = f"{STRING_API_URL}/{STRING_OUTPUT_FORMAT}/{method}"
+    for attempt in range(STRING_MAX_RETRIES + 1):
+        _string_pacer().wait()
+        response = _http_client().post(url, data=params)
+        if response.status_code not in STRING_RETRY_STATUSES or attempt == STRING_MAX_RETRIES:
+            break
+        time.sleep(0.3 * 2 ** attempt)
+    response.raise_for_status()
+    try:
+        return orjson.loads(response.content)
+    except ValueError as e:
+        raise ValueError(f"Response content: {response.text[:500]}...") from e
+
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def _fetch_string_network(uniprot_id, species, min_score, add_nodes=0):
+    # Raises on failure so that only successful responses end up in the cache
     params = {
         "identifiers": uniprot_id,
         "species": species,
         "caller_identity": "streamlit_app_proteinhub",
         "required_score": int(min_score * 1000)
     }
-    url = f"{STRING_API_URL}/{STRING_OUTPUT_FORMAT}/{STRING_METHOD}"
+    # Only sent when asked for: without it STRING keeps its default of adding 10 partners to a single-protein query
+    if add_nodes:
+        params["add_nodes"] = add_nodes
+    return _post_string(STRING_METHOD, params)
+
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def _fetch_string_ids(identifiers, species):
+    params = {
+        "identifiers": identifiers,
+        "species": species,
+        "caller_identity": "streamlit_app_proteinhub",
+        "limit": 1,
+        "echo_query": 1
+    }
+    return _post_string("get_string_ids", params)
+
+def resolve_query_names(identifiers, species=9606):
+    # STRING's preferred names for the user's identifiers (UniProt accessions, synonyms, any case),
+    # i.e. the names they carry in the network. Falls back to the identifiers as typed if the
+    # lookup fails: it only decides which query proteins survive trimming, never the fetch itself
+    try:
+        rows = _fetch_string_ids("\r".join(sorted(identifiers)), species)
+    except (httpx.HTTPError, ValueError):
+        return list(identifiers)
+    if not isinstance(rows, list):
+        return list(identifiers)
+    names = [row.get('preferredName') for row in rows if isinstance(row, dict)]
+    return [name for name in names if name] or list(identifiers)
+
+def get_string_interactions(uniprot_id, species=9606, min_score=0.4, add_nodes=0):
+    # Returns (data, error_msg); the caller decides how to render the error.
+    # The slider moves in 0.01 steps, so rounding keeps float noise out of the cache key
     try:
-        response = requests.post(url, data=params)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        st.error(f"Error fetching data from STRING DB: {e}")
-        return None
-    except ValueError:
-        st.error("Error decoding JSON response from STRING DB. The API might have returned an unexpected format.")
-        if 'response' in locals() and response: # Check if response object exists
-            st.error(f"Response content: {response.text[:500]}...")
-        return None
-
-def build_network(data):
-    G = nx.DiGraph()
+        return _fetch_string_network(uniprot_id, species, round(min_score, 2), add_nodes), None
+    except httpx.HTTPError as e:
+        return None, f"Error fetching data from STRING DB: {e}"
+    except ValueError as e:
+        return None, ("Error decoding JSON response from STRING DB. "
+                      f"The API might have returned an unexpected format. {e}")
+
+def fetch_string_interactions(identifiers, species=9606, min_score=0.4, add_nodes=0):
+    # Long lists are split into chunks and every pair of chunks is queried together, so
+    # interactions between proteins in different chunks are kept; the queries are I/O-bound
+    # and run in a small thread pool, with request starts paced by _string_pacer. The number of
+    # chunk pairs grows quadratically, so lists above MAX_IDENTIFIERS are rejected.
+    # add_nodes is passed on to every query, so each chunk pair may bring in its own partners.
+    # Returns (data, error_msg) like get_string_interactions.
+    # Order does not matter to STRING, so sorting lets "TP53,EGFR" and "EGFR,TP53" share cache entries
+    # STRING separates identifiers with a carriage return; the form body encodes it once as %0D
+    if len(identifiers) > MAX_IDENTIFIERS:
+        return None, (f"Too many identifiers ({len(identifiers)}); at most {MAX_IDENTIFIERS} can be "
+                      "queried at once to stay within STRING's rate limit.")
+    identifiers = sorted(identifiers)
+    if len(identifiers) <= MAX_IDS_PER_REQUEST:
+        return get_string_interactions("\r".join(identifiers), species, min_score, add_nodes)
+    chunk_size = MAX_IDS_PER_REQUEST // 2
+    chunks = [identifiers[i:i + chunk_size] for i in range(0, len(identifiers), chunk_size)]
+    queries = ["\r".join(a + b) for a, b in itertools.combinations(chunks, 2)]
+    with ThreadPoolExecutor(max_workers=STRING_MAX_WORKERS) as pool:
+        results = list(pool.map(lambda query: get_string_interactions(query, species, min_score, add_nodes), queries))
+    for _, error in results:
+        if error:
+            return None, error
+    # Pairs within a chunk come back once per chunk pair that contains it
+    seen, data = set(), []
+    for rows, _ in results:
+        for row in rows:
+            pair = frozenset((row.get('preferredName_A'), row.get('preferredName_B')))
+            if pair not in seen:
+                seen.add(pair)
+                data.append(row)
+    return data, None
+
+def interaction_edges(data):
+    # Valid (protein_a, protein_b, score) triples of a STRING payload as a sorted tuple, one per
+    # protein pair; being order-independent, it gives the same node numbering in network_arrays every time
     if not data or not isinstance(data, list):
-        return G
-    for interaction in data:
-        p1 = interaction.get('preferredName_A')
-        p2 = interaction.get('preferredName_B')
-        score = interaction.get('score')
-        if p1 and p2 and score is not None:
-            G.add_edge(p1, p2, weight=float(score))
-    return G
-
-def find_hub_genes(G, top_n=5):
-    if G.number_of_nodes() == 0:
+        return ()
+    # Columnar view of the payload so row validation is one vectorized mask (missing scores become NaN)
+    name_a = np.array([d.get('preferredName_A') or "" for d in data], dtype=object)
+    name_b = np.array([d.get('preferredName_B') or "" for d in data], dtype=object)
+    score = np.array([d.get('score') for d in data], dtype=float)
+    valid = (name_a != "") & (name_b != "") & ~np.isnan(score)
+    name_a, name_b, score = name_a[valid], name_b[valid], score[valid]
+    # Orient every pair as (smaller, larger) so A-B and B-A rows sort next to each other; within a
+    # pair scores ascend, so the last (highest) score wins in the dict
+    swap = name_a > name_b
+    first, second = np.where(swap, name_b, name_a), np.where(swap, name_a, name_b)
+    best = {(a, b): s for a, b, s in sorted(zip(first.tolist(), second.tolist(), score.tolist()))}
+    return tuple((a, b, s) for (a, b), s in best.items())
+
+def network_arrays(edges):
+    # The interaction tuple as arrays: node names, an (E, 2) int32 edge index and float32 scores.
+    # Nodes are numbered in order of first appearance in the sorted edge tuple, so their order (and
+    # with it the tie-breaking of every degree ranking downstream) is the same in every process.
+    # NetworkX is only used for what gets drawn, so no per-edge attribute dicts are kept for scores
+    node_index = {}
+    for a, b, _ in edges:
+        node_index.setdefault(a, len(node_index))
+        node_index.setdefault(b, len(node_index))
+    edge_index = np.fromiter((node_index[n] for a, b, _ in edges for n in (a, b)),
+                             dtype=np.int32, count=2 * len(edges)).reshape(-1, 2)
+    weights = np.fromiter((s for _, _, s in edges), dtype=np.float32, count=len(edges))
+    return list(node_index), edge_index, weights
+
+def threshold_degrees(network, min_score):
+    # Edge mask and per-node degrees of the whole fetched network at min_score, from one bincount.
+    # Scores are float32, so the threshold is compared in float32 too (0.7 != float32(0.7) in float64)
+    mask = network['weights'] >= np.float32(min_score)
+    deg = np.bincount(network['edge_index'][mask].ravel(), minlength=len(network['nodes']))
+    return mask, deg.astype(np.int32)
+
+def rank_by_degree(nodes, deg, top_n):
+    # The top_n (node, degree) pairs, highest degree first. Ranked once per render and shared by
+    # the hub genes, the degree table and the primary hub.
+    if len(nodes) == 0:
         return []
-    degree_dict = dict(G.degree())
-    sorted_genes = sorted(degree_dict.items(), key=lambda x: x[1], reverse=True)
-    return [gene for gene, _ in sorted_genes[:top_n]]
-
-def create_graph_figure(G, hub_genes):
-    if G.number_of_nodes() == 0:
-        pos = {}
+    top_n = min(top_n, len(nodes))
+    # Partition finds the top_n-th largest degree in O(N); only nodes at or above it get sorted,
+    # stably, so ties keep graph order like the previous full sort did
+    kth = np.partition(deg, len(deg) - top_n)[len(deg) - top_n]
+    candidates = np.flatnonzero(deg >= kth)
+    ranked = candidates[np.argsort(-deg[candidates], kind='stable')]
+    return [(nodes[i], int(deg[i])) for i in ranked[:top_n]]
+
+def _repulsion_dense(pos, k2):
+    # Exact all-pairs repulsion k^2/d along delta/d, i.e. delta * k^2/d^2 (no square roots)
+    delta = pos[:, None, :] - pos[None, :, :]
+    dist2 = np.einsum('ijk,ijk->ij', delta, delta)
+    np.maximum(dist2, 1e-4, out=dist2)  # keeps coincident nodes from blowing up
+    return np.einsum('ijk,ij->ik', delta, k2 / dist2)
+
+def _repulsion_barnes_hut(pos, k2):
+    # Barnes-Hut style approximation on a quadtree stored as one grid per level. At every level a
+    # node feels the well-separated cells (children of its parent's 3x3 neighbourhood that are
+    # outside its own 3x3 neighbourhood) through their mass and centroid; at the finest level
+    # the remaining 3x3 neighbourhood is summed exactly. Cost is O(N log N) per call.
+    n = len(pos)
+    depth = max(2, int(np.ceil(np.log(max(n / 4, 1)) / np.log(4))))  # about 4 nodes per leaf cell
+    side = 1 << depth
+    lo = pos.min(axis=0)
+    span = max(np.ptp(pos, axis=0).max(), 1e-9) * (1 + 1e-9)
+    cell_xy = np.minimum(((pos - lo) / span * side).astype(np.int64), side - 1)
+    disp = np.zeros_like(pos)
+    window = np.arange(-2, 4)
+
+    for level in range(2, depth + 1):
+        grid = 1 << level
+        cx, cy = (cell_xy >> (depth - level)).T
+        cell_id = cx * grid + cy
+        mass = np.bincount(cell_id, minlength=grid * grid).astype(pos.dtype)
+        centroid = np.stack([np.bincount(cell_id, weights=pos[:, 0], minlength=grid * grid),
+                             np.bincount(cell_id, weights=pos[:, 1], minlength=grid * grid)], axis=1).astype(pos.dtype)
+        centroid /= np.maximum(mass, 1)[:, None]
+        # The 6x6 children of the parent's neighbourhood, minus the node's own 3x3 neighbourhood
+        X = ((cx >> 1) << 1)[:, None, None] + window[None, :, None]
+        Y = ((cy >> 1) << 1)[:, None, None] + window[None, None, :]
+        X, Y = np.broadcast_arrays(X, Y)
+        far = ((X >= 0) & (X < grid) & (Y >= 0) & (Y < grid)
+               & ((np.abs(X - cx[:, None, None]) > 1) | (np.abs(Y - cy[:, None, None]) > 1)))
+        node_idx, far_cells = np.nonzero(far.reshape(n, -1))
+        other = (X.reshape(n, -1) * grid + Y.reshape(n, -1))[node_idx, far_cells]
+        delta = pos[node_idx] - centroid[other]
+        dist2 = np.maximum(np.einsum('ij,ij->i', delta, delta), 1e-4)
+        force = delta * (mass[other] * k2 / dist2)[:, None]
+        disp[:, 0] += np.bincount(node_idx, weights=force[:, 0], minlength=n)
+        disp[:, 1] += np.bincount(node_idx, weights=force[:, 1], minlength=n)
+
+    # Near field: exact pairs between each node and the nodes in its leaf's 3x3 neighbourhood
+    cx, cy = cell_xy.T
+    leaf = cx * side + cy
+    order = np.argsort(leaf, kind='stable')
+    counts = np.bincount(leaf, minlength=side * side)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    src_parts, dst_parts = [], []
+    for ox in (-1, 0, 1):
+        for oy in (-1, 0, 1):
+            nx_, ny_ = cx + ox, cy + oy
+            ok = np.flatnonzero((nx_ >= 0) & (nx_ < side) & (ny_ >= 0) & (ny_ < side))
+            neighbour = nx_[ok] * side + ny_[ok]
+            cnt = counts[neighbour]
+            within = np.arange(cnt.sum()) - np.repeat(np.cumsum(cnt) - cnt, cnt)
+            src_parts.append(np.repeat(ok, cnt))
+            dst_parts.append(order[np.repeat(starts[neighbour], cnt) + within])
+    src, dst = np.concatenate(src_parts), np.concatenate(dst_parts)
+    keep = src != dst
+    src, dst = src[keep], dst[keep]
+    delta = pos[src] - pos[dst]
+    dist2 = np.maximum(np.einsum('ij,ij->i', delta, delta), 1e-4)
+    force = delta * (k2 / dist2)[:, None]
+    disp[:, 0] += np.bincount(src, weights=force[:, 0], minlength=n)
+    disp[:, 1] += np.bincount(src, weights=force[:, 1], minlength=n)
+    return disp
+
+def _fr_layout(num_nodes, edge_index, k=None, iterations=50, seed=42, initial_pos=None):
+    # Fruchterman-Reingold on whole arrays: repulsion from all pairs (or the Barnes-Hut grid for
+    # large N), attraction only along the (E, 2) edge index, linear cooling.
+    # initial_pos holds earlier [-1, 1] coordinates with NaN rows for nodes that start at random
+    # float32 throughout: the drawing needs about three significant digits, and half-width arrays
+    # halve the memory traffic of the pairwise delta/dist2 tensors
+    rng = np.random.default_rng(seed)
+    pos = rng.random((num_nodes, 2), dtype=np.float32)
+    if initial_pos is not None:
+        placed = ~np.isnan(initial_pos).any(axis=1)
+        pos[placed] = (initial_pos[placed] + 1.0) / 2.0  # same unit square as the random start
+    if num_nodes < 2:
+        return pos
+    k = 1.0 / np.sqrt(num_nodes) if k is None else k
+    k2, inv_k = np.float32(k * k), np.float32(1.0 / k)
+    src, dst = edge_index[:, 0], edge_index[:, 1]
+    endpoints = np.concatenate([src, dst])
+    repulsion = _repulsion_barnes_hut if num_nodes > BARNES_HUT_MIN_NODES else _repulsion_dense
+    t0 = 0.1 * np.ptp(pos, axis=0).max()
+    for i in range(iterations):
+        disp = repulsion(pos, k2)
+        # Attraction d^2/k pulls both endpoints together; one bincount per axis updates all of them
+        edge_delta = pos[src] - pos[dst]
+        pull = edge_delta * (np.sqrt(np.einsum('ij,ij->i', edge_delta, edge_delta)) * inv_k)[:, None]
+        pull = np.concatenate([-pull, pull])
+        disp[:, 0] += np.bincount(endpoints, weights=pull[:, 0], minlength=num_nodes)
+        disp[:, 1] += np.bincount(endpoints, weights=pull[:, 1], minlength=num_nodes)
+        # Cap each step at the current temperature
+        t = t0 * (1.0 - i / iterations)
+        length = np.maximum(np.sqrt(np.einsum('ij,ij->i', disp, disp)), 1e-9)
+        pos += disp * (np.minimum(length, t) / length)[:, None]
+    pos -= pos.mean(axis=0)
+    return pos / max(np.abs(pos).max(), 1e-9)
+
+def _lbfgs_layout(G, nodes, edge_index, gravity=10.0, maxiter=60, initial_pos=None):
+    # Minimizes the Fruchterman-Reingold energy directly instead of iterating forces:
+    #   sum_edges d^3 / 3k  -  k^2 sum_pairs log d  +  gravity * sum |p|^2
+    # Its gradient is exactly FR's attraction minus repulsion; the weak gravity term keeps
+    # disconnected components from drifting apart. Seeded from the spectral layout, except for
+    # nodes with a position in initial_pos (same convention as in _fr_layout).
+    n = len(nodes)
+    k = 1.0 / np.sqrt(n)
+    k2, inv_k = k * k, 1.0 / k
+    src, dst = edge_index[:, 0], edge_index[:, 1]
+    pairs = np.triu_indices(n, 1)
+    spectral = nx.spectral_layout(G)
+    x0 = np.array([spectral[node] for node in nodes])
+    if initial_pos is not None:
+        placed = ~np.isnan(initial_pos).any(axis=1)
+        x0[placed] = initial_pos[placed]
+    x0 += np.random.default_rng(42).normal(0.0, 1e-3, x0.shape)  # separates coincident nodes
+
+    def energy_and_grad(x):
+        pos = x.reshape(n, 2)
+        delta = pos[:, None, :] - pos[None, :, :]
+        dist2 = np.maximum(np.einsum('ijk,ijk->ij', delta, delta), 1e-4)
+        edge_delta = pos[src] - pos[dst]
+        edge_len = np.sqrt(np.einsum('ij,ij->i', edge_delta, edge_delta))
+        energy = ((edge_len ** 3).sum() * inv_k / 3.0
+                  - 0.5 * k2 * np.log(dist2[pairs]).sum()
+                  + gravity * np.einsum('ij,ij->', pos, pos))
+        grad = -np.einsum('ijk,ij->ik', delta, k2 / dist2) + 2.0 * gravity * pos
+        pull = edge_delta * (edge_len * inv_k)[:, None]
+        grad[:, 0] += np.bincount(src, weights=pull[:, 0], minlength=n) - np.bincount(dst, weights=pull[:, 0], minlength=n)
+        grad[:, 1] += np.bincount(src, weights=pull[:, 1], minlength=n) - np.bincount(dst, weights=pull[:, 1], minlength=n)
+        return energy, grad.ravel()
+
+    if initial_pos is not None:
+        # Earlier layouts come rescaled to [-1, 1], far wider than the energy minimum; shrinking the
+        # start to its best uniform scale first keeps L-BFGS from reshuffling it while it contracts
+        scale = minimize_scalar(lambda s: energy_and_grad(s * x0.ravel())[0],
+                                bounds=(1e-3, 2.0), method='bounded').x
+        x0 *= scale
+    result = minimize(energy_and_grad, x0.ravel(), jac=True, method='L-BFGS-B',
+                      options={'maxiter': maxiter, 'gtol': 1e-3})
+    pos = result.x.reshape(n, 2)
+    pos -= pos.mean(axis=0)
+    return pos / max(np.abs(pos).max(), 1e-9)
+
+def layout_positions(nodes, edges, initial_pos=None):
+    # node -> xy for the given nodes and edges. Nodes are passed explicitly so that kept proteins
+    # without a kept neighbour still get a position. initial_pos (node -> xy of an earlier layout of
+    # the same query) warm-starts the layout, so nodes the two layouts share stay roughly in place
+    G = nx.Graph()
+    G.add_nodes_from(nodes)
+    G.add_edges_from(edges)
+    node_index = {node: i for i, node in enumerate(nodes)}
+    edge_index = np.array([(node_index[u], node_index[v]) for u, v in G.edges()], dtype=np.int32).reshape(-1, 2)
+    start, iterations = None, 50
+    if initial_pos:
+        start = np.array([initial_pos.get(node, (np.nan, np.nan)) for node in nodes], dtype=float).reshape(-1, 2)
+        if np.isnan(start[:, 0]).mean() > 0.5:
+            start = None  # mostly new nodes: a fresh layout works better
+        else:
+            iterations = WARM_START_ITERATIONS
+    if LBFGS_MIN_NODES < len(nodes) <= BARNES_HUT_MIN_NODES:
+        xy = _lbfgs_layout(G, nodes, edge_index, initial_pos=start)
     else:
-        pos = nx.spring_layout(G, seed=42, k=0.5, iterations=50)
-    
-    degrees = dict(G.degree())
-
-    edge_x, edge_y = [], []
-    for src, dst in G.edges():
-        if src in pos and dst in pos:
-            x0, y0 = pos[src]
-            x1, y1 = pos[dst]
-            edge_x.extend([x0, x1, None])
-            edge_y.extend([y0, y1, None])
-
-    edge_trace = go.Scatter(
+        k = 0.5 if len(nodes) < SMALL_LAYOUT_NODES else None
+        xy = _fr_layout(len(nodes), edge_index, k=k, iterations=iterations, initial_pos=start)
+    return dict(zip(nodes, xy))
+
+@st.cache_data(ttl=3600, max_entries=64, show_spinner=False)
+def compute_layout(nodes, edges):
+    # Cold-start layouts only, keyed on frozen node and edge tuples, so reruns with an unchanged
+    # network skip the layout entirely and every session gets the same fixed-seed positions
+    return layout_positions(nodes, edges)
+
+def drawn_nodes(network, deg, max_nodes):
+    # Indices of the nodes to draw: every node with an interaction at the current threshold, or, for
+    # larger networks, the max_nodes best-connected ones plus the user's query proteins. Layout cost
+    # grows super-linearly with N while the hub structure lives in the high-degree nodes
+    present = np.flatnonzero(deg)
+    if len(present) <= max_nodes:
+        return present
+    keep = {int(i) for i, _ in rank_by_degree(present, deg[present], max_nodes)}
+    # Query names are only needed once a network is trimmed, so they are looked up here, once per
+    # network (a failed lookup falls back to the typed identifiers and is not retried on every rerun)
+    if 'seeds' not in network:
+        network['seeds'] = resolve_query_names(network['identifiers'], network['species'])
+    seeds = {name.upper() for name in network['seeds']}
+    keep.update(int(i) for i in present if network['nodes'][i].upper() in seeds)
+    return np.array(sorted(keep), dtype=np.int64)
+
+def prepare_layout(network, layout_idx, initial_pos=None):
+    # Positions for the nodes in layout_idx, laid out on all fetched interactions among them, so a
+    # threshold change that keeps the same nodes is just a mask over `weights` instead of a new layout
+    nodes, edge_index = network['nodes'], network['edge_index']
+    selected = np.zeros(len(nodes), dtype=bool)
+    selected[layout_idx] = True
+    edges = edge_index[selected[edge_index[:, 0]] & selected[edge_index[:, 1]]].tolist()
+    layout_nodes = tuple(nodes[i] for i in layout_idx.tolist())
+    layout_edges = tuple((nodes[u], nodes[v]) for u, v in edges)
+    # Warm-started positions depend on this session's history, so they are kept in its
+    # session_state only and never go into the process-wide cache
+    if initial_pos:
+        return layout_positions(layout_nodes, layout_edges, initial_pos)
+    return compute_layout(layout_nodes, layout_edges)
+
+def create_graph_figure(G, nodes, deg, hub_genes, labelled, pos):
+    # Edge segments as [start, end, NaN] triples written with strided slices; Plotly treats NaN as a line break
+    node_index = {node: i for i, node in enumerate(nodes)}
+    xy = np.array([pos[node] for node in nodes], dtype=float).reshape(-1, 2)
+    num_edges = G.number_of_edges()
+    src_idx = np.fromiter((node_index[u] for u, _ in G.edges()), dtype=np.int32, count=num_edges)
+    dst_idx = np.fromiter((node_index[v] for _, v in G.edges()), dtype=np.int32, count=num_edges)
+    edge_x = np.empty(3 * num_edges)
+    edge_y = np.empty(3 * num_edges)
+    edge_x[0::3], edge_x[1::3], edge_x[2::3] = xy[src_idx, 0], xy[dst_idx, 0], np.nan
+    edge_y[0::3], edge_y[1::3], edge_y[2::3] = xy[src_idx, 1], xy[dst_idx, 1], np.nan
+
+    # Edges and markers are drawn with WebGL; SVG slows down badly once networks grow past a few hundred nodes
+    edge_trace = go.Scattergl(
         x=edge_x, y=edge_y,
         line=dict(width=1.0, color='rgba(150,150,150,0.8)'),
         hoverinfo='none',
         mode='lines'
     )
 
-    node_x, node_y, node_size, node_color, node_text_labels, node_hover_text = [], [], [], [], [], []
-    for node in G.nodes():
-        if node in pos:
-            x, y = pos[node]
-            degree = degrees.get(node, 0)
-            node_x.append(x)
-            node_y.append(y)
-            node_size.append(min(50, 10 + degree * 1.5))
-            node_color.append('crimson' if node in hub_genes else 'cornflowerblue')
-            node_text_labels.append(node if degree > 2 or node in hub_genes else "")
-            node_hover_text.append(f"<b>{node}</b><br>Degree: {degree}")
-
-    node_trace = go.Scatter(
+    # Node attributes as parallel arrays (one entry per node, same order as `nodes`)
+    node_names = np.array(nodes, dtype=object)
+    hubset = set(hub_genes)
+    hub_mask = np.fromiter((node in hubset for node in nodes), dtype=bool, count=len(nodes))
+    node_size = np.minimum(50, 10 + deg * 1.5)
+    node_color = hub_mask.astype(np.uint8)  # index into NODE_COLORSCALE: 0 = regular, 1 = hub
+    node_hover_text = [f"<b>{node}</b><br>Degree: {degree}" for node, degree in zip(nodes, deg)]
+    node_x, node_y = xy[:, 0], xy[:, 1]
+
+    node_trace = go.Scattergl(
         x=node_x, y=node_y,
-        mode='markers+text',
-        text=node_text_labels,
-        textposition="top center",
-        textfont=dict(color='black', size=9),
+        mode='markers',
         marker=dict(
             size=node_size,
             color=node_color,
+            colorscale=NODE_COLORSCALE,
+            cmin=0,
+            cmax=1,
+            showscale=False,
             line=dict(width=1, color='rgba(50,50,50,0.8)'),
             opacity=0.9
         ),
@@ -127,6 +481,17 @@ def create_graph_figure(G, hub_genes):
         hovertemplate='%{hovertext}<extra></extra>'
     )
 
+    # Labels live in their own small SVG trace so text layout only touches the labelled nodes
+    label_idx = np.fromiter((node_index[node] for node in labelled), dtype=np.int32, count=len(labelled))
+    label_trace = go.Scatter(
+        x=node_x[label_idx], y=node_y[label_idx],
+        mode='text',
+        text=node_names[label_idx],
+        textposition="top center",
+        textfont=dict(color='black', size=9),
+        hoverinfo='skip'
+    )
+
     layout = go.Layout(
         title=dict(
             text="<b>Protein Interaction Network</b>",
@@ -144,9 +509,104 @@ def create_graph_figure(G, hub_genes):
         height=600
     )
 
-    return go.Figure(data=[edge_trace, node_trace], layout=layout)
+    return go.Figure(data=[edge_trace, node_trace, label_trace], layout=layout)
 
 # -------------- Streamlit UI --------------
+@st.fragment
+def render_network(network):
+    # Runs as a fragment: moving these sliders reruns only this block, never the STRING fetch
+    col1, col2 = st.columns(2)
+    with col1:
+        score_threshold = st.slider("Interaction Score Threshold", 0.0, 1.0, 0.4, 0.01, key="score_threshold",
+                                    help="Minimum confidence score for interactions (0.0-1.0). Higher values mean more stringent, fewer interactions.")
+    with col2:
+        max_nodes = st.slider("Max nodes to display", 50, 1000, DEFAULT_MAX_NODES, 50,
+                              help="Large networks are trimmed to their highest-degree proteins (plus your query proteins) before drawing.")
+
+    mask, deg = threshold_degrees(network, score_threshold)
+    num_present = int(np.count_nonzero(deg))
+    drawn_idx = drawn_nodes(network, deg, max_nodes)
+
+    if num_present > max_nodes:
+        extra_seeds = len(drawn_idx) - max_nodes
+        st.caption(f"Showing the {max_nodes} best-connected of {num_present} proteins"
+                   + (f" plus {extra_seeds} of your query proteins" if extra_seeds else "")
+                   + ". Statistics below cover the whole network; raise 'Max nodes to display' to draw more.")
+    if score_threshold < network['min_score']:
+        st.caption(f"Interactions were fetched with score ≥ {network['min_score']:.2f}; "
+                   "click Analyze again to include lower-confidence ones.")
+
+    if num_present == 0:
+        st.warning("ℹ️ No network could be built with the given parameters. "
+                   "This might happen if the provided identifiers were not found or had no interactions "
+                   "above the selected score threshold. Try a lower score threshold or check your identifiers.")
+    else:
+        # Degrees, hubs and counts come from the whole thresholded network; trimming only affects the drawing
+        present = np.flatnonzero(deg)
+        names = network['nodes']
+        top_degrees = [(names[i], d) for i, d in rank_by_degree(present, deg[present], 20)]
+        hub_genes = [node for node, _ in top_degrees[:5]]
+        num_edges = int(np.count_nonzero(mask))
+
+        drawn = np.zeros(len(names), dtype=bool)
+        drawn[drawn_idx] = True
+        edge_index = network['edge_index']
+        drawn_edges = edge_index[mask & drawn[edge_index[:, 0]] & drawn[edge_index[:, 1]]].tolist()
+        nodes = [names[i] for i in drawn_idx.tolist()]
+        G = nx.Graph()
+        G.add_nodes_from(nodes)
+        G.add_edges_from((names[u], names[v]) for u, v in drawn_edges)
+
+        # Small networks are laid out once over every fetched node; trimmed ones over the drawn nodes
+        layout_idx = np.arange(len(network['nodes'])) if len(network['nodes']) <= max_nodes else drawn_idx
+        layout_key = tuple(layout_idx.tolist())
+        layout_state = st.session_state.get('layout')
+        if layout_state is None or layout_state['key'] != layout_key:
+            # A new node set, or Analyze again on the same query, starts from the last positions drawn
+            query = (network['species'], tuple(sorted(network['identifiers'])))
+            last_pos = st.session_state.get('last_pos') if st.session_state.get('last_query') == query else None
+            with st.spinner("⏳ Computing network layout..."):
+                layout_state = {'key': layout_key, 'pos': prepare_layout(network, layout_idx, last_pos)}
+            st.session_state['layout'] = layout_state
+            st.session_state['last_pos'], st.session_state['last_query'] = layout_state['pos'], query
+    
+        st.subheader("🔬 Network Visualization")
+        high_res_png = st.checkbox("High-resolution PNG (4× pixels)", value=False,
+                                   help="Export the camera-button PNG at 2× scale. Native resolution is enough for screens and most reports.")
+        labelled = [node for node, _ in top_degrees]
+        fig = create_graph_figure(G, nodes, deg[drawn_idx], hub_genes, labelled, layout_state['pos'])
+        # PNG export runs in the browser through the modebar camera button, no server-side rendering
+        st.plotly_chart(fig, use_container_width=True, config={
+            'toImageButtonOptions': {
+                'format': 'png',
+                'filename': f"{network['identifiers'][0]}_network",
+                'width': 1000,
+                'height': 800,
+                'scale': 2 if high_res_png else 1,
+            }
+        })
+    
+        st.subheader("📊 Network Analysis Results")
+        if hub_genes:
+            st.success(f"⭐ **Top Hub Gene(s):** {', '.join(hub_genes)}")
+        else:
+            st.info("ℹ️ No distinct hub genes found (e.g., all nodes have similar degrees or network is too small).")
+
+        col_stats1, col_stats2 = st.columns(2)
+        with col_stats1:
+            st.metric(label="Total Proteins (Nodes)", value=num_present)
+        with col_stats2:
+            st.metric(label="Total Interactions (Edges)", value=num_edges)
+    
+        with st.expander("Detailed Node Degrees (Top 20 or all)", expanded=False):
+            for i, (node, degree) in enumerate(top_degrees):
+                st.write(f"{i+1}. {node}: {degree} interactions")
+            if num_present > 20:
+                st.write(f"... and {num_present-20} more.")
+
+        main_hub_node, main_hub_degree = top_degrees[0]
+        st.info(f"🏆 **Primary Hub Gene (Highest Degree):** {main_hub_node} (Degree: {main_hub_degree})")
+
 st.title("🧬 Prot'n'Hub – Protein Interaction & Hub Gene Explorer")
 
 tabs = st.tabs(["Home", "About"])
@@ -155,48 +615,44 @@ with tabs[0]:
     st.header("Explore Protein Network")
 
     user_input = st.text_area("Enter Protein Name or UniProt ID(s)", height=100,
-                              help="Enter one or more UniProt IDs or protein names, separated by newlines or commas.")
-
-    species_dict = {
-        "Human (Homo sapiens)": 9606,
-        "Mouse (Mus musculus)": 10090,
-        "Rat (Rattus norvegicus)": 10116,
-        "Zebrafish (Danio rerio)": 7955,
-        "Fruit fly (Drosophila melanogaster)": 7227,
-        "Yeast (Saccharomyces cerevisiae)": 4932,
-        "E. coli (Escherichia coli K12)": 83333,
-        "Custom (enter manually)": None,
-    }
-    
-    col1, col2 = st.columns(2)
-    with col1:
-        selected_species_name = st.selectbox("Choose species", list(species_dict.keys()), index=0)
-    with col2:
-        score_threshold = st.slider("Interaction Score Threshold", 0.0, 1.0, 0.4, 0.01,
-                                    help="Minimum confidence score for interactions (0.0-1.0). Higher values mean more stringent, fewer interactions.")
+                              help=f"Enter up to {MAX_IDENTIFIERS} UniProt IDs or protein names, separated by newlines, commas, semicolons or spaces.")
+
+    selected_species_name = st.selectbox("Choose species", list(SPECIES_OPTIONS), index=0)
 
-    if selected_species_name == "Custom (enter manually)":
+    if selected_species_name == CUSTOM_SPECIES:
         species = st.number_input("Enter NCBI Taxonomy ID", value=9606, min_value=0, step=1)
     else:
-        species = species_dict[selected_species_name]
+        species = SPECIES_OPTIONS[selected_species_name]
+
+    add_nodes = st.number_input("Additional interaction partners", value=0, min_value=0, max_value=MAX_ADD_NODES, step=50,
+                                help="Ask STRING to extend the network with this many extra proteins beyond your query. "
+                                     "Without them, a multi-protein query only returns interactions among the proteins you entered.")
 
     if st.button("🔍 Analyze", type="primary", use_container_width=True):
         with st.spinner("⏳ Fetching and analyzing data... Please wait."):
+            st.session_state.pop('network', None)
+            st.session_state.pop('layout', None)
             raw_input = user_input.strip()
             if not raw_input:
                 st.warning("⚠️ Please enter at least one Protein Name or UniProt ID.")
                 st.stop()
 
-            identifiers_list = [ident.strip() for ident_group in raw_input.split(',')
-                                for ident in ident_group.splitlines() if ident.strip()]
+            # Merged lists often repeat proteins; keep the first spelling of each, ignoring case
+            unique_ids = {}
+            for ident in ID_SEPARATORS.split(raw_input):
+                if ident:
+                    unique_ids.setdefault(ident.upper(), ident)
+            identifiers_list = list(unique_ids.values())
             if not identifiers_list:
                 st.warning("⚠️ No valid identifiers found after processing input.")
                 st.stop()
 
-            uniprot_ids_for_api = "%0d".join(identifiers_list)
-            string_data = get_string_interactions(uniprot_ids_for_api, species, score_threshold)
+            # Fetch at a low floor once; the score slider then only filters edges locally
+            fetch_score = min(st.session_state.get('score_threshold', 0.4), FETCH_MIN_SCORE)
+            string_data, fetch_error = fetch_string_interactions(identifiers_list, species, fetch_score, add_nodes)
 
-            if string_data is None:
+            if fetch_error:
+                st.error(fetch_error)
                 st.stop()
             if not string_data:
                 st.info(f"ℹ️ No interaction data found for '{', '.join(identifiers_list)}' with the current settings. "
@@ -204,60 +660,14 @@ with tabs[0]:
                          "the species, or the score threshold. Try a lower score or check your input.")
                 st.stop()
 
-            G = build_network(string_data)
-            if G.number_of_nodes() == 0:
-                st.warning("ℹ️ No network could be built with the given parameters. "
-                           "This might happen if the provided identifiers were not found or had no interactions "
-                           "above the selected score threshold. Try a lower score threshold or check your identifiers.")
-                st.stop()
+            nodes, edge_index, weights = network_arrays(interaction_edges(string_data))
+            st.session_state['network'] = {'nodes': nodes, 'edge_index': edge_index, 'weights': weights,
+                                           'min_score': fetch_score, 'identifiers': identifiers_list,
+                                           'species': species}
 
-            hub_genes = find_hub_genes(G)
-            
-            st.subheader("🔬 Network Visualization")
-            fig = create_graph_figure(G, hub_genes)
-            st.plotly_chart(fig, use_container_width=True)
-
-            # --- REMOVED PNG DOWNLOAD SECTION ---
-            # try:
-            #     buf = io.BytesIO()
-            #     fig.write_image(buf, format="png", width=1200, height=900, scale=2, engine="kaleido")
-            #     st.download_button(
-            #         label="📥 Download Network as PNG",
-            #         data=buf.getvalue(),
-            #         file_name=f"{identifiers_list[0]}_network.png",
-            #         mime="image/png",
-            #         use_container_width=True
-            #     )
-            # except Exception as e:
-            #     st.error(f"Could not generate PNG for download. Make sure 'kaleido' is installed (`pip install kaleido`). Error: {e}")
-            # --- END OF REMOVED SECTION ---
-            
-            st.subheader("📊 Network Analysis Results")
-            if hub_genes:
-                st.success(f"⭐ **Top Hub Gene(s):** {', '.join(hub_genes)}")
-            else:
-                st.info("ℹ️ No distinct hub genes found (e.g., all nodes have similar degrees or network is too small).")
-
-            col_stats1, col_stats2 = st.columns(2)
-            with col_stats1:
-                st.metric(label="Total Proteins (Nodes)", value=G.number_of_nodes())
-            with col_stats2:
-                st.metric(label="Total Interactions (Edges)", value=G.number_of_edges())
-            
-            degree_dict = dict(G.degree())
-            if degree_dict:
-                with st.expander("Detailed Node Degrees (Top 20 or all)", expanded=False):
-                    sorted_degrees = sorted(degree_dict.items(), key=lambda item: item[1], reverse=True)
-                    for i, (node, degree) in enumerate(sorted_degrees[:20]):
-                        st.write(f"{i+1}. {node}: {degree} interactions")
-                    if len(sorted_degrees) > 20:
-                        st.write(f"... and {len(sorted_degrees)-20} more.")
-
-                if sorted_degrees: 
-                    main_hub_node, main_hub_degree = sorted_degrees[0]
-                    st.info(f"🏆 **Primary Hub Gene (Highest Degree):** {main_hub_node} (Degree: {main_hub_degree})")
-            else:
-                st.info("No nodes to determine degrees or main hub gene.")
+    network = st.session_state.get('network')
+    if network is not None:
+        render_network(network)
 
 with tabs[1]:
     st.header("About Prot'n'Hub")